@@ -1,12 +1,23 @@
 #信号叠加显示，变化率及信号均移动平均
 
 # 导入需要的库
+import functools
+import itertools
+import threading
+import uuid
+import warnings
+from collections import OrderedDict
+
+import numpy as np
 import pandas as pd
-from dash import Dash, dcc, html, Input, Output, State
+from numpy.lib.stride_tricks import sliding_window_view
+from dash import Dash, dcc, html, dash_table, Input, Output, State
 import plotly.express as px
 import plotly.graph_objects as go
+from plotly.subplots import make_subplots
 import matplotlib.pyplot as plt
 from dash.dependencies import ALL
+from dash.exceptions import PreventUpdate
 
 plt.rcParams['font.sans-serif'] = ['SimHei']
 plt.rcParams['axes.unicode_minus'] = False
@@ -45,19 +56,255 @@ trend_indicators = ["双均线", "中值双均线", "考夫曼均线", "TRIX指
 oscillators = ["顺势指标CCI", "布林带", "日内动量"]
 volume_indicators = ["佳庆指标", "波动趋势"]
 
+# ========== 归一化预计算 ==========
+# 每条序列由 经纪商 + 合约 + 多/空头 唯一确定，归一化在序列内部进行
+series_keys = ['经纪商名称', '合约名称', '多/空头']
+norm_cols = indicator_cols + ['持仓量', '价格']
+norm_modes = {
+    'none': '原始值',
+    'minmax': 'Min-Max',
+    'zscore': 'Z-Score',
+    'rolling_zscore': '滚动Z-Score',
+    'rank': '百分位排名'
+}
+rolling_z_window = 60
+
+def build_normalized(frame, cols, mode, window=rolling_z_window):
+    grouped = frame.groupby(series_keys, observed=True, sort=False)[cols]
+    values = frame[cols]
+    if mode == 'minmax':
+        lo = grouped.transform('min')
+        span = grouped.transform('max') - lo
+        # 常数序列归一化为0，避免除零
+        return ((values - lo) / span.where(span != 0)).mask(span == 0, values * 0)
+    if mode == 'zscore':
+        std = grouped.transform('std')
+        return ((values - grouped.transform('mean')) / std.where(std != 0)).mask(std == 0, values * 0)
+    if mode == 'rolling_zscore':
+        # 滚动窗口依赖序列内的日期顺序，先排序，结果再按原索引对齐
+        ordered = frame.sort_values(series_keys + ['日期'])
+        rolling = ordered.groupby(series_keys, observed=True, sort=False)[cols].rolling(window=window, min_periods=2)
+        level = list(range(len(series_keys)))
+        mean = rolling.mean().droplevel(level).reindex(frame.index)
+        std = rolling.std().droplevel(level).reindex(frame.index)
+        return ((values - mean) / std.where(std != 0)).mask(std == 0, values * 0)
+    if mode == 'rank':
+        return grouped.rank(pct=True)
+    return values
+
+# 加载时一次性计算所有模式，回调中按索引查表
+normalized = {mode: build_normalized(df, norm_cols, mode) for mode in norm_modes if mode != 'none'}
+
+def lookup_normalized(dff, cols, mode):
+    if not mode or mode == 'none':
+        return dff[cols]
+    return normalized[mode].loc[dff.index, cols]
+
+# ========== 事件研究预计算 ==========
+# 各序列按日期首尾相接排成一个二维数组，序列之间以 NaN 隔开，
+# 这样任意事件的前后窗口都可以通过滑动窗口视图直接切出，不会跨越序列
+event_max_window = 30
+event_types = {1: '加仓', -1: '减仓'}
+
+def build_event_panels(frame, cols, pad=event_max_window):
+    codes = frame.groupby(series_keys, observed=True, sort=False).ngroup().to_numpy()
+    order = np.lexsort((frame['日期'].to_numpy(), codes))
+    positions = np.empty(len(frame), dtype=np.int64)
+    positions[order] = np.arange(len(frame)) + pad * (codes[order] + 1)
+    length = len(frame) + pad * (codes.max() + 2)
+    panels = {}
+    for mode in norm_modes:
+        panel = np.full((length, len(cols)), np.nan)
+        panel[positions] = lookup_normalized(frame, cols, mode).to_numpy(dtype=float)
+        panels[mode] = panel
+    return pd.Series(positions, index=frame.index), panels
+
+event_positions, event_panels = build_event_panels(df, indicator_cols)
+
+# 返回 {仓位动作: 数组(事件数, 指标数, 2*window+1)}
+# 偏移量按序列内的记录行计数，序列中缺少交易日时并不等同于自然交易日数
+def extract_event_windows(dff, cols, window, mode='none'):
+    window = min(window, event_max_window)
+    col_idx = np.array([indicator_cols.index(c) for c in cols])
+    # 在完整面板上建视图 (行数 - 2*window, 全部指标数, 2*window+1)，不复制数据；
+    # 只在按事件取出的小数组上选择指标列
+    views = sliding_window_view(event_panels[mode or 'none'], 2 * window + 1, axis=0)
+    windows = {}
+    for action in event_types:
+        centers = event_positions.loc[dff.index[dff['加/减仓'].to_numpy() == action]].to_numpy()
+        windows[action] = views[(centers - window)[:, None], col_idx]
+    return windows
+
+# ========== 领先/滞后互相关 ==========
+# 每条序列按交易日放在一条长轴上，序列之间留出至少 max_lag 的空白，
+# 一次 FFT 即可得到所有序列、所有滞后阶数的互相关而不会跨序列配对
+lag_max_range = 60
+lag_targets = {'变化率': '持仓变化率', '价格变化率': '价格变化率'}
+trading_days = np.sort(df['日期'].unique())
+day_index = pd.Series(np.searchsorted(trading_days, df['日期'].to_numpy()), index=df.index)
+series_code = pd.Series(df.groupby(series_keys, observed=True, sort=False).ngroup().to_numpy(), index=df.index)
+
+def lead_lag_correlation(dff, cols, target, max_lag):
+    codes = np.unique(series_code.loc[dff.index].to_numpy(), return_inverse=True)[1]
+    stride = len(trading_days) + max_lag
+    positions = codes * stride + day_index.loc[dff.index].to_numpy()
+    length = (codes.max() + 1) * stride
+    nfft = 1 << int(np.ceil(np.log2(length + max_lag)))
+
+    def standardize(values):
+        # 先整体中心化、缩放以减小 FFT 舍入误差（不影响 Pearson 结果），缺失值置零并记录掩码
+        values = np.where(np.isfinite(values), values, np.nan)
+        with np.errstate(all='ignore'):
+            z = (values - np.nanmean(values, axis=0)) / np.nanstd(values, axis=0)
+        mask = np.isfinite(z)
+        return np.where(mask, z, 0.0), mask.astype(float)
+
+    def spectrum(values):
+        out = np.zeros((values.shape[1], length))
+        out[:, positions] = values.T
+        return np.fft.rfft(out, nfft)
+
+    lags = np.arange(-max_lag, max_lag + 1)
+
+    # 第 k 项为 sum_t a(t) * b(t + k)，k > 0 表示指标领先
+    def cross(fa, fb):
+        return np.fft.irfft(np.conj(fa) * fb, nfft)[:, lags % nfft]
+
+    x, x_mask = standardize(dff[cols].to_numpy(dtype=float))
+    y, y_mask = standardize(dff[[target]].to_numpy(dtype=float))
+    fx, fxx, fxm = spectrum(x), spectrum(x ** 2), spectrum(x_mask)
+    fy, fyy, fym = spectrum(y), spectrum(y ** 2), spectrum(y_mask)
+    # 每个滞后阶数只使用两侧同时非缺失的样本对，与 rolling_correlation 相同地由充分统计量得到 Pearson
+    n = np.rint(cross(fxm, fym))
+    sx, sxx = cross(fx, fym), cross(fxx, fym)
+    sy, syy = cross(fxm, fy), cross(fxm, fyy)
+    sxy = cross(fx, fy)
+    var_x = n * sxx - sx ** 2
+    var_y = n * syy - sy ** 2
+    # FFT 舍入使常数序列的方差略偏离零，按相对误差判定
+    valid = (n > 2) & (var_x > 1e-9 * n * sxx) & (var_y > 1e-9 * n * syy)
+    with np.errstate(all='ignore'):
+        corr = np.where(valid, (n * sxy - sx * sy) / np.sqrt(var_x * var_y), np.nan)
+    corr = np.clip(corr, -1, 1)
+    return pd.DataFrame(corr.T, index=lags, columns=cols)
+
+# ========== 滚动相关 ==========
+# 按交易日累加成对的充分统计量并求前缀和，任一窗口的统计量只需一次相减，
+# 每个窗口步长的代价为 O(k^2)，无需逐窗口调用 .corr()
+rolling_corr_cols = indicator_cols + ['变化率']
+
+@functools.lru_cache(maxsize=32)
+def rolling_correlation(filter_key, window):
+    selected_brokers, selected_year, selected_long_short, selected_action, selected_contract = filter_key
+    dff = df[(df['经纪商名称'].isin(selected_brokers)) &
+             (df['年份'].isin(selected_year))]
+    if selected_contract:
+        dff = dff[dff['合约名称'].isin(selected_contract)]
+    if selected_long_short:
+        dff = dff[dff['多/空头'].isin(selected_long_short)]
+    if selected_action:
+        dff = dff[dff['加/减仓'].isin(selected_action)]
+    if dff.empty:
+        return None
+    values = dff[rolling_corr_cols].to_numpy(dtype=float)
+    mask = np.isfinite(values)
+    x = np.where(mask, values, 0.0)
+    m = mask.astype(float)
+    days = day_index.loc[dff.index].to_numpy()
+    start = days.min()
+    days = days - start
+    n_days, k = days.max() + 1, len(rolling_corr_cols)
+    # 每日统计量：成对样本数、sum(x_i)、sum(x_i^2)（均限定 x_j 同时非缺失）及 sum(x_i * x_j)，
+    # 按日期排序后逐日做矩阵乘法累加，临时内存为 O(交易日数 * k^2)
+    order = np.argsort(days, kind='stable')
+    x, m, days_sorted = x[order], m[order], days[order]
+    starts = np.flatnonzero(np.r_[True, np.diff(days_sorted) != 0])
+    ends = np.r_[starts[1:], len(days_sorted)]
+    daily = np.zeros((n_days, 4, k, k))
+    for start_row, end_row in zip(starts, ends):
+        xb, mb = x[start_row:end_row], m[start_row:end_row]
+        day = daily[days_sorted[start_row]]
+        day[0] = mb.T @ mb
+        day[1] = xb.T @ mb
+        day[2] = (xb ** 2).T @ mb
+        day[3] = xb.T @ xb
+    cumulative = np.concatenate([np.zeros((1,) + daily.shape[1:]), np.cumsum(daily, axis=0)])
+    upper = np.arange(1, n_days + 1)
+    lower = np.maximum(upper - window, 0)
+    n, sx, sxx, sxy = np.moveaxis(cumulative[upper] - cumulative[lower], 1, 0)
+    sy = np.swapaxes(sx, 1, 2)
+    syy = np.swapaxes(sxx, 1, 2)
+    with np.errstate(all='ignore'):
+        var = (n * sxx - sx ** 2) * (n * syy - sy ** 2)
+        corr = (n * sxy - sx * sy) / np.sqrt(np.where((var > 0) & (n > 2), var, np.nan))
+    # 切片开头不足 window 个交易日的窗口不完整，不输出
+    corr[upper - lower < window] = np.nan
+    present = np.unique(days)
+    return trading_days[start + present], np.clip(corr[present], -1, 1)
+
+# ========== 经纪商排行榜 ==========
+# 按 经纪商 + 多/空头 + 年份 一次分组求和得到可加的充分统计量，
+# 任意年份/多空组合只需再对统计量求和即可得到相关系数与命中率
+leaderboard_keys = ['经纪商名称', '多/空头', '年份']
+leaderboard_targets = {'变化率': '变化率相关', '持仓量': '持仓量相关'}
+
+# df 只在启动时读取一次，统计量同样只需计算一次
+@functools.lru_cache(maxsize=1)
+def leaderboard_stats():
+    x = df[indicator_cols]
+    parts = {}
+    for target in leaderboard_targets:
+        y = df[target].replace([np.inf, -np.inf], np.nan)
+        valid = x.notna() & y.notna().to_numpy()[:, None]
+        xv = x.where(valid)
+        yv = valid.mul(y, axis=0).where(valid)
+        parts[f'{target}_n'] = valid.astype(int)
+        parts[f'{target}_x'] = xv
+        parts[f'{target}_y'] = yv
+        parts[f'{target}_xy'] = xv * yv
+        parts[f'{target}_xx'] = xv ** 2
+        parts[f'{target}_yy'] = yv ** 2
+    # 命中：信号方向与加/减仓方向一致，仅统计两者均非零的记录
+    direction = np.sign(x)
+    active = (direction != 0) & x.notna() & (df['加/减仓'] != 0).to_numpy()[:, None]
+    parts['hit_n'] = active.astype(int)
+    parts['hit'] = (direction.eq(df['加/减仓'], axis=0) & active).astype(int)
+    wide = pd.concat(parts, axis=1)
+    return wide.groupby([df[k] for k in leaderboard_keys], observed=True).sum()
+
+def build_leaderboard(selected_year=None, selected_long_short=None):
+    stats = leaderboard_stats()
+    if selected_year:
+        stats = stats[stats.index.get_level_values('年份').isin(selected_year)]
+    if selected_long_short:
+        stats = stats[stats.index.get_level_values('多/空头').isin(selected_long_short)]
+    agg = stats.groupby(level=['经纪商名称', '多/空头']).sum()
+    result = {}
+    for target, label in leaderboard_targets.items():
+        n, sx, sy = agg[f'{target}_n'], agg[f'{target}_x'], agg[f'{target}_y']
+        cov = n * agg[f'{target}_xy'] - sx * sy
+        var = (n * agg[f'{target}_xx'] - sx ** 2) * (n * agg[f'{target}_yy'] - sy ** 2)
+        result[label] = cov / np.sqrt(var.where(var > 0))
+    result['命中率'] = agg['hit'] / agg['hit_n'].where(agg['hit_n'] > 0)
+    result['事件数'] = agg['hit_n']
+    table = pd.concat(result, axis=1).stack(future_stack=True).reset_index()
+    table.columns = ['经纪商名称', '多/空头', '指标'] + list(result)
+    table.insert(1, '多空', table.pop('多/空头').map({'l': '多头', 's': '空头'}))
+    return table.round(3).sort_values('变化率相关', key=abs, ascending=False)
+
 # ========== 初始化 Dash App ==========
 app = Dash(__name__)
 server = app.server  # 这行加在`app = Dash(__name__)`之后
 # ========== 工具函数 ==========
-def add_reference_lines(fig, dff, show_ref, yaxis_id='y3'):
-    def normalize(series):
-        if series.max() == series.min():
-            return series * 0  # 避免除零
-        return (series - series.min()) / (series.max() - series.min())
+def add_reference_lines(fig, dff, show_ref, yaxis_id='y3', norm_mode='minmax'):
+    # 参考线始终归一化显示，原始值模式下退回 Min-Max
+    if not show_ref:
+        return fig
+    ref_values = lookup_normalized(dff, ['持仓量', '价格'], norm_mode if norm_mode != 'none' else 'minmax')
     if 'holding' in show_ref:
         fig.add_trace(go.Scatter(
             x=dff['日期'],
-            y=normalize(dff['持仓量']),
+            y=ref_values['持仓量'],
             name='持仓量参考',
             line=dict(color='blue', dash='dot', width=3),
             opacity=1,
@@ -66,7 +313,7 @@ def add_reference_lines(fig, dff, show_ref, yaxis_id='y3'):
     if 'price' in show_ref:
         fig.add_trace(go.Scatter(
             x=dff['日期'],
-            y=normalize(dff['价格']),
+            y=ref_values['价格'],
             name='价格参考',
             line=dict(color='red', dash='dot', width=3),
             opacity=1,
@@ -74,8 +321,72 @@ def add_reference_lines(fig, dff, show_ref, yaxis_id='y3'):
         ))
     return fig
 
+# ========== 请求合并 ==========
+# 同一会话对同一输出的请求只保留最新一次：旧请求在检查点处放弃，结果也不再返回。
+# 令牌保存在进程内存中，只在单进程多线程部署下生效（开发服务器，或
+# gunicorn --workers 1 --threads N 的 gthread 模式）；多个 sync worker 之间
+# 不共享令牌，新请求无法让其他 worker 上的旧请求失效，此时退化为逐个完整计算。
+debounce_ms = 300
+max_tracked_requests = 4096
+_request_lock = threading.Lock()
+_request_ids = itertools.count(1)
+# (会话ID, 输出ID) -> 最新令牌，按最近使用淘汰，避免随页面加载无限增长
+_latest_requests = OrderedDict()
+_active_request = threading.local()
+
+def latest_only(output_id):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args):
+            # 最后一个参数固定为 State('session-id', 'data')
+            *inputs, session_id = args
+            key = (session_id, output_id)
+            with _request_lock:
+                token = next(_request_ids)
+                _latest_requests[key] = token
+                _latest_requests.move_to_end(key)
+                while len(_latest_requests) > max_tracked_requests:
+                    _latest_requests.popitem(last=False)
+            _active_request.key, _active_request.token = key, token
+            try:
+                result = func(*inputs)
+                abort_if_stale()
+                return result
+            finally:
+                _active_request.key = None
+        return wrapper
+    return decorator
+
+def abort_if_stale():
+    key = getattr(_active_request, 'key', None)
+    if key is None:
+        return
+    # 已被淘汰的键无法判断新旧，按最新处理
+    latest = _latest_requests.get(key, _active_request.token)
+    if latest != _active_request.token:
+        raise PreventUpdate
+
+# 滑块在浏览器端去抖，停止拖动 debounce_ms 毫秒后才写入 <id>-debounced
+def debounce_slider(slider_id, delay=debounce_ms):
+    app.clientside_callback(
+        """
+        function(value) {
+            const tokens = window._sliderDebounce = window._sliderDebounce || {};
+            const token = (tokens['%(id)s'] || 0) + 1;
+            tokens['%(id)s'] = token;
+            return new Promise(function(resolve) {
+                setTimeout(function() {
+                    resolve(tokens['%(id)s'] === token ? value : window.dash_clientside.no_update);
+                }, %(delay)d);
+            });
+        }
+        """ % {'id': slider_id, 'delay': delay},
+        Output(f'{slider_id}-debounced', 'data'),
+        Input(slider_id, 'value')
+    )
+
 # 应用布局设计
-app.layout = html.Div([
+main_layout = html.Div([
     html.H2("豆粕持仓数据分析系统", style={"textAlign": "center"}),
     
     # 筛选控件
@@ -146,7 +457,20 @@ app.layout = html.Div([
             step=1,
             value=7,
             marks={i: str(i) for i in [1, 5, 10, 15, 20, 25, 30]},
+            updatemode='drag',
             tooltip={'placement': 'bottom', 'always_visible': True}
+        ),
+        dcc.Store(id='smoothing-window-debounced', data=7)
+    ], style={'margin': '20px 0'}),
+
+    # 信号归一化方式
+    html.Div([
+        html.Label("信号归一化:", style={'font-weight': 'bold', 'margin-right': '10px'}),
+        dcc.RadioItems(
+            id='normalize-mode',
+            options=[{'label': label, 'value': mode} for mode, label in norm_modes.items()],
+            value='none',
+            inline=True
         )
     ], style={'margin': '20px 0'}),
 
@@ -314,6 +638,126 @@ app.layout = html.Div([
         dcc.Graph(id='volume-chart')
     ], style={'padding': '10px', 'border': '1px solid #eee', 'border-radius': '5px'}),
 
+    html.Hr(),
+
+    # 事件研究：加/减仓前后信号表现
+    html.Div([
+        html.H4("加/减仓事件研究", style={'margin-bottom': '10px'}),
+        html.Div([
+            html.Label("选择指标:", style={'font-weight': 'bold'}),
+            dcc.Dropdown(
+                id='event-signal-control',
+                options=[{'label': sig, 'value': sig} for sig in indicator_cols],
+                value=trend_indicators,
+                multi=True,
+                style={'width': '100%'}
+            ),
+            html.Label("事件前后窗口(天):", style={'font-weight': 'bold'}),
+            dcc.Slider(
+                id='event-window',
+                min=1,
+                max=event_max_window,
+                step=1,
+                value=10,
+                marks={i: str(i) for i in [1, 5, 10, 15, 20, 25, 30]},
+                updatemode='drag',
+                tooltip={'placement': 'bottom', 'always_visible': True}
+            ),
+            dcc.Store(id='event-window-debounced', data=10)
+        ], style={'margin-bottom': '15px'}),
+        dcc.Graph(id='event-study-chart')
+    ], style={'padding': '10px', 'border': '1px solid #eee', 'border-radius': '5px'}),
+
+    html.Hr(),
+
+    # 领先/滞后分析
+    html.Div([
+        html.H4("指标领先/滞后分析", style={'margin-bottom': '10px'}),
+        html.Div([
+            html.Label("选择指标:", style={'font-weight': 'bold'}),
+            dcc.Dropdown(
+                id='lag-signal-control',
+                options=[{'label': sig, 'value': sig} for sig in indicator_cols],
+                value=fundamental_signals,
+                multi=True,
+                style={'width': '100%'}
+            ),
+            html.Label("对比对象:", style={'font-weight': 'bold'}),
+            dcc.RadioItems(
+                id='lag-target-control',
+                options=[{'label': label, 'value': col} for col, label in lag_targets.items()],
+                value='变化率',
+                inline=True
+            ),
+            html.Label("最大滞后(天):", style={'font-weight': 'bold'}),
+            dcc.Slider(
+                id='lag-range',
+                min=5,
+                max=lag_max_range,
+                step=1,
+                value=20,
+                marks={i: str(i) for i in [5, 10, 20, 30, 40, 50, 60]},
+                updatemode='drag',
+                tooltip={'placement': 'bottom', 'always_visible': True}
+            ),
+            dcc.Store(id='lag-range-debounced', data=20)
+        ], style={'margin-bottom': '15px'}),
+        dcc.Graph(id='lead-lag-chart')
+    ], style={'padding': '10px', 'border': '1px solid #eee', 'border-radius': '5px'}),
+
+    html.Hr(),
+
+    # 滚动相关时间轴
+    html.Div([
+        html.H4("滚动相关时间轴", style={'margin-bottom': '10px'}),
+        html.Div([
+            html.Label("选择指标:", style={'font-weight': 'bold'}),
+            dcc.Dropdown(
+                id='rolling-signal-control',
+                options=[{'label': sig, 'value': sig} for sig in indicator_cols],
+                value=trend_indicators,
+                multi=True,
+                style={'width': '100%'}
+            ),
+            html.Label("滚动窗口(天):", style={'font-weight': 'bold'}),
+            dcc.Slider(
+                id='rolling-window',
+                min=10,
+                max=120,
+                step=5,
+                value=20,
+                marks={i: str(i) for i in [10, 20, 40, 60, 80, 100, 120]},
+                updatemode='drag',
+                tooltip={'placement': 'bottom', 'always_visible': True}
+            ),
+            dcc.Store(id='rolling-window-debounced', data=20),
+            dcc.Checklist(
+                id='rolling-matrix-control',
+                options=[{'label': '显示按月相关矩阵动画', 'value': 'show_matrix'}],
+                value=[],
+                inline=True
+            )
+        ], style={'margin-bottom': '15px'}),
+        dcc.Graph(id='rolling-corr-chart'),
+        dcc.Graph(id='rolling-corr-matrix')
+    ], style={'padding': '10px', 'border': '1px solid #eee', 'border-radius': '5px'}),
+
+    html.Hr(),
+
+    # 经纪商 × 指标 排行榜
+    html.Div([
+        html.H4("经纪商信号排行榜", style={'margin-bottom': '10px'}),
+        html.P("按上方年份、多/空头筛选；相关为指标与持仓变化率/持仓量的相关系数，命中率为指标方向与加/减仓方向一致的比例。"),
+        dash_table.DataTable(
+            id='leaderboard-table',
+            columns=[{'name': c, 'id': c} for c in ['经纪商名称', '多空', '指标'] + list(leaderboard_targets.values()) + ['命中率', '事件数']],
+            sort_action='native',
+            filter_action='native',
+            page_size=20,
+            style_table={'overflowX': 'auto'},
+            style_cell={'textAlign': 'center', 'padding': '4px'}
+        )
+    ], style={'padding': '10px', 'border': '1px solid #eee', 'border-radius': '5px'}),
 
     html.Hr(),
     dcc.Graph(id='heatmap-all')
@@ -323,6 +767,19 @@ app.layout = html.Div([
     # dcc.Graph(id='shap-action-heatmap')
 ])
 
+# 每次打开页面生成独立的会话ID，用于服务端请求合并
+def serve_layout():
+    return html.Div([
+        dcc.Store(id='session-id', data=str(uuid.uuid4())),
+        main_layout
+    ])
+
+app.layout = serve_layout
+debounce_slider('smoothing-window')
+debounce_slider('event-window')
+debounce_slider('lag-range')
+debounce_slider('rolling-window')
+
 # ========== 回调函数 ==========
 
 # 更新合约名称下拉选项
@@ -360,8 +817,10 @@ def update_contract_dropdown(selected_brokers, selected_year, selected_long_shor
      Input('action-dropdown', 'value'),
      Input('contract-dropdown', 'value'),
      Input('main-abs-control', 'value'),
-     Input('smoothing-window', 'value')]
+     Input('smoothing-window-debounced', 'data')],
+    State('session-id', 'data')
 )
+@latest_only('main-chart-absolute')
 def update_main_chart_absolute(selected_brokers, selected_year, selected_long_short, selected_action,
                               selected_contract, display_options, window_size):
     if not selected_brokers or not selected_year or not selected_contract:
@@ -377,6 +836,7 @@ def update_main_chart_absolute(selected_brokers, selected_year, selected_long_sh
         dff = dff[dff['多/空头'].isin(selected_long_short)]
     if selected_action:
         dff = dff[dff['加/减仓'].isin(selected_action)]
+    abort_if_stale()
     fig = go.Figure()
     if 'holding' in display_options:
         fig.add_trace(go.Scatter(
@@ -413,8 +873,10 @@ def update_main_chart_absolute(selected_brokers, selected_year, selected_long_sh
      Input('action-dropdown', 'value'),
      Input('contract-dropdown', 'value'),
      Input('main-change-control', 'value'),
-     Input('smoothing-window', 'value')]
+     Input('smoothing-window-debounced', 'data')],
+    State('session-id', 'data')
 )
+@latest_only('main-chart-change')
 def update_main_chart_change(selected_brokers, selected_year, selected_long_short, selected_action,
                             selected_contract, display_options, window_size):
     if not selected_brokers or not selected_year or not selected_contract:
@@ -430,6 +892,7 @@ def update_main_chart_change(selected_brokers, selected_year, selected_long_shor
         dff = dff[dff['多/空头'].isin(selected_long_short)]
     if selected_action:
         dff = dff[dff['加/减仓'].isin(selected_action)]
+    abort_if_stale()
     dff['平滑变化率'] = dff['变化率'].rolling(window=window_size, min_periods=1).mean()
     dff['平滑价格变化率'] = dff['价格变化率'].rolling(window=window_size, min_periods=1).mean()
     fig = go.Figure()
@@ -471,10 +934,13 @@ def update_main_chart_change(selected_brokers, selected_year, selected_long_shor
      Input('fundamental-control', 'value'),
      Input('fundamental-avg-control', 'value'),
      Input('fundamental-ref-control', 'value'),
-     Input('smoothing-window', 'value')]
+     Input('smoothing-window-debounced', 'data'),
+     Input('normalize-mode', 'value')],
+    State('session-id', 'data')
 )
+@latest_only('fundamental-chart')
 def update_fundamental_chart(selected_brokers, selected_year, selected_long_short, selected_action,
-                            selected_contract, display_signals, show_avg, show_ref, window_size):
+                            selected_contract, display_signals, show_avg, show_ref, window_size, norm_mode):
     if not selected_brokers or not selected_year or not selected_contract or not display_signals:
         return go.Figure()
     if isinstance(selected_year, int):
@@ -488,9 +954,11 @@ def update_fundamental_chart(selected_brokers, selected_year, selected_long_shor
         dff = dff[dff['多/空头'].isin(selected_long_short)]
     if selected_action:
         dff = dff[dff['加/减仓'].isin(selected_action)]
+    abort_if_stale()
     fig = go.Figure()
+    signal_values = lookup_normalized(dff, display_signals, norm_mode)
     for signal in display_signals:
-        smooth_signal = dff[signal].rolling(window=window_size, min_periods=1).mean()
+        smooth_signal = signal_values[signal].rolling(window=window_size, min_periods=1).mean()
         fig.add_trace(go.Scatter(
             x=dff['日期'], y=smooth_signal,
             mode='lines',
@@ -499,7 +967,7 @@ def update_fundamental_chart(selected_brokers, selected_year, selected_long_shor
             opacity=0.4
         ))
     if 'show_avg' in show_avg and len(display_signals) > 1:
-        avg_values = dff[display_signals].mean(axis=1).rolling(window=window_size, min_periods=1).mean()
+        avg_values = signal_values.mean(axis=1).rolling(window=window_size, min_periods=1).mean()
         fig.add_trace(go.Scatter(
             x=dff['日期'], y=avg_values,
             mode='lines',
@@ -507,7 +975,7 @@ def update_fundamental_chart(selected_brokers, selected_year, selected_long_shor
             line=dict(color='black', width=3, dash='dash')
         ))
     # 参考线画在右轴
-    fig = add_reference_lines(fig, dff, show_ref, yaxis_id='y3')
+    fig = add_reference_lines(fig, dff, show_ref, yaxis_id='y3', norm_mode=norm_mode)
     fig.update_layout(
         title='基本面信号',
         height=400,
@@ -538,10 +1006,13 @@ def update_fundamental_chart(selected_brokers, selected_year, selected_long_shor
      Input('trend-control', 'value'),
      Input('trend-avg-control', 'value'),
      Input('trend-ref-control', 'value'),
-     Input('smoothing-window', 'value')]
+     Input('smoothing-window-debounced', 'data'),
+     Input('normalize-mode', 'value')],
+    State('session-id', 'data')
 )
+@latest_only('trend-chart')
 def update_trend_chart(selected_brokers, selected_year, selected_long_short, selected_action,
-                       selected_contract, display_signals, show_avg, show_ref, window_size):
+                       selected_contract, display_signals, show_avg, show_ref, window_size, norm_mode):
     if not selected_brokers or not selected_year or not selected_contract or not display_signals:
         return go.Figure()
     if isinstance(selected_year, int):
@@ -555,9 +1026,11 @@ def update_trend_chart(selected_brokers, selected_year, selected_long_short, sel
         dff = dff[dff['多/空头'].isin(selected_long_short)]
     if selected_action:
         dff = dff[dff['加/减仓'].isin(selected_action)]
+    abort_if_stale()
     fig = go.Figure()
+    signal_values = lookup_normalized(dff, display_signals, norm_mode)
     for signal in display_signals:
-        smooth_signal = dff[signal].rolling(window=window_size, min_periods=1).mean()
+        smooth_signal = signal_values[signal].rolling(window=window_size, min_periods=1).mean()
         fig.add_trace(go.Scatter(
             x=dff['日期'], y=smooth_signal,
             mode='lines',
@@ -567,14 +1040,14 @@ def update_trend_chart(selected_brokers, selected_year, selected_long_short, sel
 
         ))
     if 'show_avg' in show_avg and len(display_signals) > 1:
-        avg_values = dff[display_signals].mean(axis=1).rolling(window=window_size, min_periods=1).mean()
+        avg_values = signal_values.mean(axis=1).rolling(window=window_size, min_periods=1).mean()
         fig.add_trace(go.Scatter(
             x=dff['日期'], y=avg_values,
             mode='lines',
             name='平均值',
             line=dict(color='black', width=3, dash='dash')
         ))
-    fig = add_reference_lines(fig, dff, show_ref, yaxis_id='y3')
+    fig = add_reference_lines(fig, dff, show_ref, yaxis_id='y3', norm_mode=norm_mode)
     fig.update_layout(
         title='趋势类指标',
         height=400,
@@ -605,10 +1078,13 @@ def update_trend_chart(selected_brokers, selected_year, selected_long_short, sel
      Input('oscillator-control', 'value'),
      Input('oscillator-avg-control', 'value'),
      Input('oscillator-ref-control', 'value'),
-     Input('smoothing-window', 'value')]
+     Input('smoothing-window-debounced', 'data'),
+     Input('normalize-mode', 'value')],
+    State('session-id', 'data')
 )
+@latest_only('oscillator-chart')
 def update_oscillator_chart(selected_brokers, selected_year, selected_long_short, selected_action,
-                           selected_contract, display_signals, show_avg, show_ref, window_size):
+                           selected_contract, display_signals, show_avg, show_ref, window_size, norm_mode):
     if not selected_brokers or not selected_year or not selected_contract or not display_signals:
         return go.Figure()
     if isinstance(selected_year, int):
@@ -622,9 +1098,11 @@ def update_oscillator_chart(selected_brokers, selected_year, selected_long_short
         dff = dff[dff['多/空头'].isin(selected_long_short)]
     if selected_action:
         dff = dff[dff['加/减仓'].isin(selected_action)]
+    abort_if_stale()
     fig = go.Figure()
+    signal_values = lookup_normalized(dff, display_signals, norm_mode)
     for signal in display_signals:
-        smooth_signal = dff[signal].rolling(window=window_size, min_periods=1).mean()
+        smooth_signal = signal_values[signal].rolling(window=window_size, min_periods=1).mean()
         fig.add_trace(go.Scatter(
             x=dff['日期'], y=smooth_signal,
             mode='lines',
@@ -633,14 +1111,14 @@ def update_oscillator_chart(selected_brokers, selected_year, selected_long_short
             opacity=0.4
         ))
     if 'show_avg' in show_avg and len(display_signals) > 1:
-        avg_values = dff[display_signals].mean(axis=1).rolling(window=window_size, min_periods=1).mean()
+        avg_values = signal_values.mean(axis=1).rolling(window=window_size, min_periods=1).mean()
         fig.add_trace(go.Scatter(
             x=dff['日期'], y=avg_values,
             mode='lines',
             name='平均值',
             line=dict(color='black', width=3, dash='dash')
         ))
-    fig = add_reference_lines(fig, dff, show_ref, yaxis_id='y3')
+    fig = add_reference_lines(fig, dff, show_ref, yaxis_id='y3', norm_mode=norm_mode)
     fig.update_layout(
         title='震荡类指标',
         height=400,
@@ -670,10 +1148,13 @@ def update_oscillator_chart(selected_brokers, selected_year, selected_long_short
      Input('volume-control', 'value'),
      Input('volume-avg-control', 'value'),
      Input('volume-ref-control', 'value'),
-     Input('smoothing-window', 'value')]
+     Input('smoothing-window-debounced', 'data'),
+     Input('normalize-mode', 'value')],
+    State('session-id', 'data')
 )
+@latest_only('volume-chart')
 def update_volume_chart(selected_brokers, selected_year, selected_long_short, selected_action,
-                        selected_contract, display_signals, show_avg, show_ref, window_size):
+                        selected_contract, display_signals, show_avg, show_ref, window_size, norm_mode):
     if not selected_brokers or not selected_year or not selected_contract or not display_signals:
         return go.Figure()
     
@@ -692,9 +1173,11 @@ def update_volume_chart(selected_brokers, selected_year, selected_long_short, se
     if selected_action:
         dff = dff[dff['加/减仓'].isin(selected_action)]
     
+    abort_if_stale()
     fig = go.Figure()
+    signal_values = lookup_normalized(dff, display_signals, norm_mode)
     for signal in display_signals:
-        smooth_signal = dff[signal].rolling(window=window_size, min_periods=1).mean()
+        smooth_signal = signal_values[signal].rolling(window=window_size, min_periods=1).mean()
         fig.add_trace(go.Scatter(
             x=dff['日期'], y=smooth_signal,
             mode='lines',
@@ -704,7 +1187,7 @@ def update_volume_chart(selected_brokers, selected_year, selected_long_short, se
         ))
     
     if 'show_avg' in show_avg and len(display_signals) > 1:
-        avg_values = dff[display_signals].mean(axis=1).rolling(window=window_size, min_periods=1).mean()
+        avg_values = signal_values.mean(axis=1).rolling(window=window_size, min_periods=1).mean()
         fig.add_trace(go.Scatter(
             x=dff['日期'], y=avg_values,
             mode='lines',
@@ -712,7 +1195,7 @@ def update_volume_chart(selected_brokers, selected_year, selected_long_short, se
             line=dict(color='black', width=3, dash='dash')
         ))
     
-    fig = add_reference_lines(fig, dff, show_ref, yaxis_id='y3')
+    fig = add_reference_lines(fig, dff, show_ref, yaxis_id='y3', norm_mode=norm_mode)
     
     fig.update_layout(
         title='量能类指标',
@@ -726,6 +1209,265 @@ def update_volume_chart(selected_brokers, selected_year, selected_long_short, se
     return fig
 
 
+# 更新事件研究图表
+@app.callback(
+    Output('event-study-chart', 'figure'),
+    [Input('broker-dropdown', 'value'),
+     Input('year-dropdown', 'value'),
+     Input('long-short-dropdown', 'value'),
+     Input('action-dropdown', 'value'),
+     Input('contract-dropdown', 'value'),
+     Input('event-signal-control', 'value'),
+     Input('event-window-debounced', 'data'),
+     Input('normalize-mode', 'value')],
+    State('session-id', 'data')
+)
+@latest_only('event-study-chart')
+def update_event_study(selected_brokers, selected_year, selected_long_short, selected_action,
+                       selected_contract, display_signals, window, norm_mode):
+    # 合约可不选，此时使用所有合约中的事件
+    if not selected_brokers or not selected_year or not display_signals:
+        return go.Figure()
+    if isinstance(selected_year, int):
+        selected_year = [selected_year]
+    if isinstance(selected_contract, str):
+        selected_contract = [selected_contract]
+    dff = df[(df['经纪商名称'].isin(selected_brokers)) &
+             (df['年份'].isin(selected_year))]
+    if selected_contract:
+        dff = dff[dff['合约名称'].isin(selected_contract)]
+    if selected_long_short:
+        dff = dff[dff['多/空头'].isin(selected_long_short)]
+    if selected_action:
+        dff = dff[dff['加/减仓'].isin(selected_action)]
+    abort_if_stale()
+    windows = extract_event_windows(dff, display_signals, window, norm_mode)
+    offsets = np.arange(-window, window + 1)
+    colors = {1: 'red', -1: 'green'}
+    band_colors = {1: 'rgba(255,0,0,0.15)', -1: 'rgba(0,128,0,0.15)'}
+    n_cols = 2
+    n_rows = (len(display_signals) + n_cols - 1) // n_cols
+    fig = make_subplots(rows=n_rows, cols=n_cols, subplot_titles=display_signals,
+                        shared_xaxes=True, vertical_spacing=0.08)
+    for action, label in event_types.items():
+        stack = windows[action]
+        if len(stack) == 0:
+            continue
+        # 沿事件维度聚合，得到 (指标数, 窗口长度)
+        # 窗口边缘可能全为缺失值，nanmean/nanpercentile 会经 warnings 模块告警
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            mean = np.nanmean(stack, axis=0)
+            lower, upper = np.nanpercentile(stack, [25, 75], axis=0)
+        for i, signal in enumerate(display_signals):
+            row, col = i // n_cols + 1, i % n_cols + 1
+            fig.add_trace(go.Scatter(
+                x=np.concatenate([offsets, offsets[::-1]]),
+                y=np.concatenate([upper[i], lower[i][::-1]]),
+                fill='toself',
+                fillcolor=band_colors[action],
+                line=dict(width=0),
+                hoverinfo='skip',
+                legendgroup=label,
+                showlegend=False
+            ), row=row, col=col)
+            fig.add_trace(go.Scatter(
+                x=offsets, y=mean[i],
+                mode='lines',
+                name=f'{label} (n={len(stack)})',
+                line=dict(color=colors[action], width=2),
+                legendgroup=label,
+                showlegend=(i == 0)
+            ), row=row, col=col)
+    fig.update_layout(
+        title='加/减仓事件前后信号均值 (阴影为25%-75%分位)',
+        height=max(400, 250 * n_rows),
+        hovermode='x unified',
+        showlegend=True,
+        margin=dict(l=60, r=60, t=80, b=60)
+    )
+    # 事件当日以零线标出
+    fig.update_xaxes(zeroline=True, zerolinecolor='gray', zerolinewidth=1)
+    fig.update_xaxes(title_text='距事件天数 (按序列内记录计)', row=n_rows)
+    return fig
+
+# 更新领先/滞后图表
+@app.callback(
+    Output('lead-lag-chart', 'figure'),
+    [Input('broker-dropdown', 'value'),
+     Input('year-dropdown', 'value'),
+     Input('long-short-dropdown', 'value'),
+     Input('action-dropdown', 'value'),
+     Input('contract-dropdown', 'value'),
+     Input('lag-signal-control', 'value'),
+     Input('lag-target-control', 'value'),
+     Input('lag-range-debounced', 'data')],
+    State('session-id', 'data')
+)
+@latest_only('lead-lag-chart')
+def update_lead_lag(selected_brokers, selected_year, selected_long_short, selected_action,
+                    selected_contract, display_signals, target, max_lag):
+    # 合约可不选，此时合并所有合约的序列
+    if not selected_brokers or not selected_year or not display_signals:
+        return go.Figure()
+    if isinstance(selected_year, int):
+        selected_year = [selected_year]
+    if isinstance(selected_contract, str):
+        selected_contract = [selected_contract]
+    dff = df[(df['经纪商名称'].isin(selected_brokers)) &
+             (df['年份'].isin(selected_year))]
+    if selected_contract:
+        dff = dff[dff['合约名称'].isin(selected_contract)]
+    if selected_long_short:
+        dff = dff[dff['多/空头'].isin(selected_long_short)]
+    if selected_action:
+        dff = dff[dff['加/减仓'].isin(selected_action)]
+    if dff.empty:
+        return go.Figure()
+    abort_if_stale()
+    corr = lead_lag_correlation(dff, display_signals, target, max_lag)
+    # 峰值滞后：绝对相关最大的滞后阶数；序列内为常数的指标各阶均为 NaN，不参与
+    valid = corr.dropna(axis=1, how='all')
+    peak_lag = valid.abs().idxmax()
+    peak_corr = pd.Series({sig: valid.at[peak_lag[sig], sig] for sig in valid.columns}, dtype=float)
+    fig = make_subplots(rows=1, cols=2, column_widths=[0.65, 0.35],
+                        subplot_titles=['互相关系数', '峰值滞后'])
+    for signal in display_signals:
+        fig.add_trace(go.Scatter(
+            x=corr.index, y=corr[signal],
+            mode='lines',
+            name=signal,
+            line=dict(width=1.5)
+        ), row=1, col=1)
+    fig.add_trace(go.Bar(
+        x=peak_lag, y=peak_corr.index,
+        orientation='h',
+        marker=dict(color=peak_corr, colorscale='RdBu_r', cmin=-1, cmax=1),
+        text=[f'{r:.2f}' for r in peak_corr],
+        name='峰值滞后',
+        showlegend=False
+    ), row=1, col=2)
+    fig.update_xaxes(title_text='滞后天数 (正值: 指标领先)', zeroline=True, zerolinecolor='gray')
+    fig.update_layout(
+        title=f'指标与{lag_targets[target]}的领先/滞后相关',
+        height=max(450, 30 * len(display_signals)),
+        hovermode='x unified',
+        margin=dict(l=60, r=60, t=80, b=60)
+    )
+    return fig
+
+# 筛选条件转为可哈希的元组，作为滚动相关的缓存键
+def rolling_filter_key(selected_brokers, selected_year, selected_long_short, selected_action, selected_contract):
+    if isinstance(selected_year, int):
+        selected_year = [selected_year]
+    if isinstance(selected_contract, str):
+        selected_contract = [selected_contract]
+    return tuple(tuple(sorted(v)) if v else () for v in
+                 [selected_brokers, selected_year, selected_long_short, selected_action, selected_contract])
+
+# 更新滚动相关时间轴
+@app.callback(
+    Output('rolling-corr-chart', 'figure'),
+    [Input('broker-dropdown', 'value'),
+     Input('year-dropdown', 'value'),
+     Input('long-short-dropdown', 'value'),
+     Input('action-dropdown', 'value'),
+     Input('contract-dropdown', 'value'),
+     Input('rolling-signal-control', 'value'),
+     Input('rolling-window-debounced', 'data')],
+    State('session-id', 'data')
+)
+@latest_only('rolling-corr-chart')
+def update_rolling_corr(selected_brokers, selected_year, selected_long_short, selected_action,
+                        selected_contract, display_signals, window):
+    # 合约可不选，此时合并所有合约
+    if not selected_brokers or not selected_year or not display_signals:
+        return go.Figure()
+    abort_if_stale()
+    result = rolling_correlation(rolling_filter_key(selected_brokers, selected_year, selected_long_short,
+                                                    selected_action, selected_contract), window)
+    if result is None:
+        return go.Figure()
+    dates, corr = result
+    target = rolling_corr_cols.index('变化率')
+    fig = go.Figure()
+    for signal in display_signals:
+        fig.add_trace(go.Scatter(
+            x=dates, y=corr[:, rolling_corr_cols.index(signal), target],
+            mode='lines',
+            name=signal,
+            line=dict(width=1.5)
+        ))
+    fig.update_layout(
+        title=f'各指标与持仓变化率的{window}日滚动相关',
+        height=400,
+        hovermode='x unified',
+        showlegend=True,
+        margin=dict(l=60, r=60, t=60, b=60),
+        yaxis=dict(title='相关系数', range=[-1, 1]),
+        xaxis=dict(title='日期')
+    )
+    return fig
+
+# 更新按月滚动相关矩阵动画
+@app.callback(
+    Output('rolling-corr-matrix', 'figure'),
+    [Input('broker-dropdown', 'value'),
+     Input('year-dropdown', 'value'),
+     Input('long-short-dropdown', 'value'),
+     Input('action-dropdown', 'value'),
+     Input('contract-dropdown', 'value'),
+     Input('rolling-matrix-control', 'value'),
+     Input('rolling-window-debounced', 'data')],
+    State('session-id', 'data')
+)
+@latest_only('rolling-corr-matrix')
+def update_rolling_corr_matrix(selected_brokers, selected_year, selected_long_short, selected_action,
+                               selected_contract, show_matrix, window):
+    if not selected_brokers or not selected_year or 'show_matrix' not in show_matrix:
+        return go.Figure()
+    abort_if_stale()
+    result = rolling_correlation(rolling_filter_key(selected_brokers, selected_year, selected_long_short,
+                                                    selected_action, selected_contract), window)
+    if result is None:
+        return go.Figure()
+    dates, corr = result
+    # 每月取最后一个交易日的窗口作为一帧
+    months = pd.Series(pd.DatetimeIndex(dates).to_period('M').astype(str))
+    month_end = months.drop_duplicates(keep='last')
+    fig = px.imshow(
+        corr[month_end.index],
+        x=rolling_corr_cols,
+        y=rolling_corr_cols,
+        animation_frame=0,
+        color_continuous_scale='RdBu_r',
+        zmin=-1,
+        zmax=1,
+        aspect="auto"
+    )
+    for frame, step, label in zip(fig.frames, fig.layout.sliders[0].steps, month_end):
+        frame.name = label
+        step.label = label
+        step.args = [[label]] + list(step.args[1:])
+    fig.update_layout(
+        title=f'{window}日滚动相关矩阵 (按月)',
+        height=1000,
+        width=1200,
+        margin=dict(l=60, r=60, t=60, b=60)
+    )
+    return fig
+
+# 更新经纪商排行榜
+@app.callback(
+    Output('leaderboard-table', 'data'),
+    [Input('year-dropdown', 'value'),
+     Input('long-short-dropdown', 'value')]
+)
+def update_leaderboard(selected_year, selected_long_short):
+    if isinstance(selected_year, int):
+        selected_year = [selected_year]
+    return build_leaderboard(selected_year, selected_long_short).to_dict('records')
+
 # 更新热力图
 @app.callback(
     Output('heatmap-all', 'figure'),
@@ -733,8 +1475,10 @@ def update_volume_chart(selected_brokers, selected_year, selected_long_short, se
      Input('year-dropdown', 'value'),
      Input('long-short-dropdown', 'value'),
      Input('action-dropdown', 'value'),
-     Input('contract-dropdown', 'value')]
+     Input('contract-dropdown', 'value')],
+    State('session-id', 'data')
 )
+@latest_only('heatmap-all')
 def update_heatmap(selected_brokers, selected_year, selected_long_short, selected_action, selected_contract):
     if not selected_brokers or not selected_year or not selected_contract:
         return go.Figure()
@@ -749,6 +1493,7 @@ def update_heatmap(selected_brokers, selected_year, selected_long_short, selecte
         dff = dff[dff['多/空头'].isin(selected_long_short)]
     if selected_action:
         dff = dff[dff['加/减仓'].isin(selected_action)]
+    abort_if_stale()
     sub_df = dff[indicator_cols].dropna(how='all')
     if sub_df.empty:
         return go.Figure()